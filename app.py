@@ -1,10 +1,24 @@
+import argparse
+import asyncio
+import contextlib
 import csv
+import glob
+import gzip
+import hashlib
+import itertools
 import sys
-import time
 import os
-from typing import List, Tuple, Optional
+import time
+import zlib
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Tuple, Optional, TextIO
 
+import httpx
+import ijson
+from aiolimiter import AsyncLimiter
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ========= CONFIGURATION =========
 BRAND_ID = 2005  # <-- put your brand ID here
@@ -13,14 +27,199 @@ BEARER_TOKEN = "c81cf09ca837e9323260cca8da760572dc9d3fb5f1cf6c4ed46d1dcd5e0c"  #
 # Path to your input CSV (must contain a column named "product_source_id")
 INPUT_CSV_PATH = "URBN product source ID.csv"
 # Output CSV will be created/updated incrementally
+# (with --shards N > 1, rows go to product_media_report.part{0..N-1}.csv instead)
 OUTPUT_CSV_PATH = "product_media_report.csv"
 
-REQUEST_DELAY_SECONDS = 0.2
+# Media requests are started at no more than this rate; on HTTP 429 the
+# request is retried after the server's Retry-After, up to this many times.
+# Retry-After is capped since the wait holds a CONCURRENCY slot.
+REQUESTS_PER_SECOND = 20
+MAX_RATE_LIMIT_RETRIES = 5
+MAX_RETRY_AFTER_SECONDS = 60.0
+# Transient server errors on media requests are retried with exponential
+# backoff (RETRY_BACKOFF_FACTOR * 2**attempt seconds), up to this many times
+RETRY_STATUSES = (500, 502, 503, 504)
+MAX_SERVER_ERROR_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.3
+# Output rows are flushed to disk every this many rows (and on exit)
+FLUSH_EVERY_ROWS = 50
+# Successful API responses are cached here so re-runs skip the network
+CACHE_DIR = "dh_cache"
+MEDIA_CACHE_TTL_SECONDS = 3600
+SELF_CACHE_TTL_SECONDS = 86400
+# Media responses larger than this are spooled to the cache and parsed
+# incrementally instead of being loaded into memory in one piece
+STREAM_THRESHOLD_BYTES = 8 * 1024 * 1024
+# Maximum number of media requests in flight at once
+CONCURRENCY = 16
 
 LIBRARY_BASE_URL = "https://app.dashhudson.com"
 LIBRARY_BACKEND_BASE_URL = "https://library-backend.dashhudson.com"
 AUTH_BASE_URL = "https://auth.dashhudson.com"
 
+FIELDNAMES = [
+    "product_id",         # this is product_source_id from the feed
+    "dash_id",            # internal Dash product.id
+    "dash_library_link",
+    "product_url",
+    "media_count",
+    "media_image_urls"
+]
+
+_MEDIA_URL = f"{LIBRARY_BACKEND_BASE_URL}/public/brands/{BRAND_ID}/products/media"
+_AUTH_HEADERS = {
+    "Authorization": f"Bearer {BEARER_TOKEN}",
+    "Accept": "application/json",
+}
+
+# Shared session so the TCP/TLS connection is reused across calls
+SESSION = requests.Session()
+SESSION.headers.update(_AUTH_HEADERS)
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+        ),
+    ),
+)
+
+
+def _cache_path(key: Tuple) -> str:
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, f"{digest}.json.gz")
+
+
+def _gzip_uncompressed_size(path: str) -> int:
+    # ISIZE trailer: the last 4 bytes of a gzip file hold the uncompressed
+    # length mod 2**32, which is exact for any realistic response
+    with open(path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        return int.from_bytes(f.read(4), "little")
+
+
+def cache_lookup(key: Tuple, ttl_seconds: float) -> Tuple[Optional[str], int]:
+    """
+    Return (path, uncompressed size) of the cache entry for key, or (None, 0)
+    if it is missing or older than ttl_seconds (stale entries are deleted).
+    """
+    path = _cache_path(key)
+    try:
+        st = os.stat(path)
+        if time.time() - st.st_mtime > ttl_seconds:
+            os.remove(path)  # prune so the cache dir doesn't grow forever
+            return None, 0
+        return path, _gzip_uncompressed_size(path)
+    except OSError:
+        return None, 0
+
+
+def prune_cache() -> None:
+    """
+    Delete cache entries older than the longest TTL, plus temp files left
+    by interrupted runs. Called once at startup; expired entries for keys
+    that are looked up again are also deleted by cache_lookup.
+    """
+    max_ttl = max(MEDIA_CACHE_TTL_SECONDS, SELF_CACHE_TTL_SECONDS)
+    now = time.time()
+    for path in glob.glob(os.path.join(glob.escape(CACHE_DIR), "*")):
+        try:
+            if path.endswith(".tmp") or (
+                path.endswith(".json.gz") and now - os.path.getmtime(path) > max_ttl
+            ):
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def cache_get(key: Tuple, ttl_seconds: float) -> Optional[bytes]:
+    """
+    Return the cached response body for key, or None if it is missing
+    or older than ttl_seconds.
+    """
+    path, _ = cache_lookup(key, ttl_seconds)
+    if path is None:
+        return None
+    try:
+        with gzip.open(path, "rb") as f:
+            return f.read()
+    except (OSError, EOFError):
+        return None
+
+
+def cache_put(key: Tuple, body: bytes) -> None:
+    """
+    Store a response body for key. Written to a temp file first so an
+    interrupted run never leaves a truncated entry behind.
+    """
+    path = _cache_path(key)
+    tmp_path = path + ".tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+    except OSError as exc:
+        print(f"Could not write cache entry {path}: {exc}", file=sys.stderr)
+
+
+async def spool_response(
+    chunks: AsyncIterator[bytes],
+    key: Tuple,
+    head: List[bytes],
+) -> str:
+    """
+    Write a response body to a temp file next to the cache entry for key and
+    return its path: first the already-read chunks in head, then the rest of
+    chunks as they arrive. iter_media_file moves it into the cache once it
+    has parsed as a JSON array. Compression and disk writes run in a worker
+    thread so other requests keep flowing.
+    """
+    tmp_path = _cache_path(key) + ".tmp"
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    try:
+        with gzip.open(tmp_path, "wb") as f:
+            await asyncio.to_thread(f.writelines, head)
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return tmp_path
+
+
+def iter_media_file(path: str, cache_path: Optional[str] = None) -> Iterator[dict]:
+    """
+    Lazily yield the media objects of a spooled or cached JSON array, one
+    at a time. This blocks on disk and parsing, so consume it off the event
+    loop. Raises ValueError if the file is not a complete JSON array, after
+    removing it so it is not served from the cache. If cache_path is given
+    the file is moved there once it has parsed cleanly.
+    """
+    try:
+        with gzip.open(path, "rb") as f:
+            events = ijson.parse(f, use_float=True)
+            first = next(events, None)
+            if first is None or first[1] != "start_array":
+                raise ValueError("response is not a JSON array")
+            yield from ijson.items(itertools.chain([first], events), "item")
+    except (ValueError, ijson.JSONError, OSError, EOFError) as exc:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise ValueError(str(exc)) from exc
+
+    if cache_path is not None:
+        os.replace(path, cache_path)
+
 
 def get_brand_name(brand_id: int) -> str:
     """
@@ -29,82 +228,148 @@ def get_brand_name(brand_id: int) -> str:
     Returns the brand_name string (for example 'sunny-today').
     """
     url = f"{AUTH_BASE_URL}/api/self"
-    headers = {
-        "Authorization": f"Bearer {BEARER_TOKEN}",
-        "Accept": "application/json",
-    }
-
-    try:
-        resp = requests.get(url, headers=headers, timeout=30)
-    except requests.RequestException as exc:
-        print(f"Error calling /api/self: {exc}", file=sys.stderr)
-        sys.exit(1)
+    cache_key = ("self", BEARER_TOKEN)
+
+    body = cache_get(cache_key, SELF_CACHE_TTL_SECONDS)
+    from_cache = body is not None
+
+    if not from_cache:
+        try:
+            resp = SESSION.get(url, timeout=30)
+        except requests.RequestException as exc:
+            print(f"Error calling /api/self: {exc}", file=sys.stderr)
+            sys.exit(1)
+
+        if resp.status_code != 200:
+            print(
+                f"Non-200 from /api/self: {resp.status_code} {resp.text}",
+                file=sys.stderr,
+            )
+            sys.exit(1)
 
-    if resp.status_code != 200:
-        print(
-            f"Non-200 from /api/self: {resp.status_code} {resp.text}",
-            file=sys.stderr,
-        )
-        sys.exit(1)
+        body = resp.content
 
     try:
-        data = resp.json()
-    except ValueError:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
         print("Invalid JSON from /api/self", file=sys.stderr)
         sys.exit(1)
 
     brands = data.get("brands") or {}
     for brand_name, brand_obj in brands.items():
         if brand_obj.get("id") == brand_id:
+            # only cache a body that actually resolved the brand
+            if not from_cache:
+                cache_put(cache_key, body)
             return brand_name
 
     print(f"Brand ID {brand_id} not found in /api/self response", file=sys.stderr)
     sys.exit(1)
 
 
-def fetch_media_for_product_source_id(product_source_id: str) -> List[dict]:
+def retry_after_seconds(value: Optional[str]) -> float:
+    """
+    Seconds to wait from a Retry-After header, defaulting to 1 second
+    when it is missing or not a number of seconds, and capped at
+    MAX_RETRY_AFTER_SECONDS.
+    """
+    try:
+        return min(max(float(value), 0.0), MAX_RETRY_AFTER_SECONDS)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+async def fetch_media_for_product_source_id(
+    client: httpx.AsyncClient,
+    limiter: AsyncLimiter,
+    product_source_id: str,
+) -> Iterable[dict]:
     """
     Call the products media endpoint for a given product_source_id.
-    Returns a list of media objects (JSON array).
+    Returns the media objects (JSON array): a list for normal responses,
+    or a lazy iterator over the spooled file (see iter_media_file) for ones
+    whose decoded body exceeds STREAM_THRESHOLD_BYTES.
     """
-    url = f"{LIBRARY_BACKEND_BASE_URL}/public/brands/{BRAND_ID}/products/media"
-    headers = {
-        "Authorization": f"Bearer {BEARER_TOKEN}",
-        "Accept": "application/json",
-    }
     params = {"product_source_id": product_source_id}
+    cache_key = (BRAND_ID, product_source_id)
+
+    cached_path, cached_size = cache_lookup(cache_key, MEDIA_CACHE_TTL_SECONDS)
+    if cached_path is not None and cached_size > STREAM_THRESHOLD_BYTES:
+        return iter_media_file(cached_path)
+
+    body = cache_get(cache_key, MEDIA_CACHE_TTL_SECONDS)
+    from_cache = body is not None
+
+    if not from_cache:
+        try:
+            for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+                await limiter.acquire()
+                async with client.stream(
+                    "GET", _MEDIA_URL, params=params, timeout=30
+                ) as r:
+                    if r.status_code == 429 and attempt < MAX_RATE_LIMIT_RETRIES:
+                        delay = retry_after_seconds(r.headers.get("Retry-After"))
+                    elif (
+                        r.status_code in RETRY_STATUSES
+                        and attempt < MAX_SERVER_ERROR_RETRIES
+                    ):
+                        delay = RETRY_BACKOFF_FACTOR * 2 ** attempt
+                    else:
+                        if r.status_code != 200:
+                            await r.aread()
+                            print(
+                                f"Non-200 ({r.status_code}) for {product_source_id}: {r.text}",
+                                file=sys.stderr,
+                            )
+                            return []
+
+                        # Content-Length is the compressed size (or absent when
+                        # chunked), so go by decoded bytes as they arrive
+                        chunks = r.aiter_bytes()
+                        head: List[bytes] = []
+                        received = 0
+                        async for chunk in chunks:
+                            head.append(chunk)
+                            received += len(chunk)
+                            if received > STREAM_THRESHOLD_BYTES:
+                                tmp_path = await spool_response(chunks, cache_key, head)
+                                return iter_media_file(tmp_path, _cache_path(cache_key))
+
+                        body = b"".join(head)
+                        break
+
+                print(
+                    f"Got {r.status_code} for {product_source_id}, retrying in {delay:g}s",
+                    file=sys.stderr,
+                )
+                await asyncio.sleep(delay)
+        except Exception as e:
+            print(f"Request error for {product_source_id}: {e}", file=sys.stderr)
+            return []
 
     try:
-        r = requests.get(url, headers=headers, params=params, timeout=30)
-    except Exception as e:
-        print(f"Request error for {product_source_id}: {e}", file=sys.stderr)
-        return []
-
-    if r.status_code != 200:
-        print(
-            f"Non-200 ({r.status_code}) for {product_source_id}: {r.text}",
-            file=sys.stderr,
-        )
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        print(f"JSON parse error for {product_source_id}", file=sys.stderr)
         return []
 
-    try:
-        data = r.json()
-    except Exception:
-        print(f"JSON parse error for {product_source_id}", file=sys.stderr)
+    if not isinstance(data, list):
         return []
 
-    return data if isinstance(data, list) else []
+    if not from_cache:
+        cache_put(cache_key, body)
+    return data
 
 
 def extract_product_info(
-    media_items: List[dict],
+    media_items: Iterable[dict],
     product_source_id: str,
 ) -> Tuple[Optional[int], Optional[str], int, List[str]]:
     """
     From the list of media items, find:
       - dash_id (product.id)
       - product_url (product.url)
-      - media_count (len(media_items))
+      - media_count (number of media items)
       - media_image_urls (list of image_sizes.original.url from each media)
 
     We match the product using:
@@ -115,31 +380,36 @@ def extract_product_info(
     dash_id: Optional[int] = None
     product_url: Optional[str] = None
     media_image_urls: List[str] = []
+    add_image_url = media_image_urls.append  # bound once, called per media
+    product_found = False
+    media_count = 0
+
+    media_iter = iter(media_items)
+    for media in media_iter:
+        media_count += 1
 
-    for media in media_items:
         # collect image url
         image_sizes = media.get("image_sizes") or {}
         orig = image_sizes.get("original") or {}
-        if orig.get("url"):
-            media_image_urls.append(orig["url"])
-
-        # once we have product info we can skip searching
-        if dash_id is not None and product_url is not None:
-            continue
+        url = orig.get("url")
+        if url:
+            add_image_url(url)
 
         # search for matching product
         for tag in media.get("products") or []:
             product = tag.get("product") or {}
             overrides = product.get("product_overrides") or []
 
-            override_match = any(
-                (ov or {}).get("source_id") == product_source_id for ov in overrides
-            )
-
+            # override ids are only collected when the direct ids don't match;
+            # only string ids go in the set since API values may be unhashable
             if (
                 tag.get("source_id") == product_source_id
                 or product.get("source_id") == product_source_id
-                or override_match
+                or product_source_id in {
+                    ov.get("source_id")
+                    for ov in overrides
+                    if isinstance(ov, dict) and isinstance(ov.get("source_id"), str)
+                }
             ):
                 if dash_id is None:
                     dash_id = product.get("id") or tag.get("product_id")
@@ -148,7 +418,17 @@ def extract_product_info(
                     product_url = product.get("url")
                 break
 
-    media_count = len(media_items)
+        product_found = dash_id is not None and product_url is not None
+        if product_found:
+            break
+
+    # once we have product info the remaining media only contribute image urls
+    for media in media_iter:
+        media_count += 1
+        orig = (media.get("image_sizes") or {}).get("original")
+        if orig and (url := orig.get("url")):
+            add_image_url(url)
+
     return dash_id, product_url, media_count, media_image_urls
 
 
@@ -156,20 +436,25 @@ def read_product_source_ids(path: str) -> List[str]:
     """
     Read product_source_id values from the input CSV.
     Expects a column named 'product_source_id'.
+    Duplicates are dropped, keeping the first occurrence's position.
     """
-    values: List[str] = []
     with open(path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        if "product_source_id" not in (reader.fieldnames or []):
+        reader = csv.reader(f)
+        header = next(reader, [])
+        if "product_source_id" not in header:
             raise ValueError(
                 f"Input CSV {path} must contain a 'product_source_id' column. "
-                f"Found columns: {reader.fieldnames}"
+                f"Found columns: {header}"
             )
+        col = header.index("product_source_id")
+
+        values: List[str] = []
         for row in reader:
-            value = (row.get("product_source_id") or "").strip()
-            if value:
-                values.append(value)
-    return values
+            if col < len(row):
+                value = row[col].strip()
+                if value:
+                    values.append(value)
+    return list(dict.fromkeys(values))
 
 
 def load_already_processed_rows(path: str) -> set:
@@ -181,64 +466,247 @@ def load_already_processed_rows(path: str) -> set:
     if not os.path.exists(path):
         return set()
 
+    # Fast path: the file was written by append_row, so product_id is the
+    # first column and rows without any quoted field are one physical line.
+    with open(path, "rb") as f:
+        header = f.readline().rstrip(b"\r\n").decode("utf-8")
+        if header == ",".join(FIELDNAMES):
+            processed = set()
+            for line in f:
+                if b'"' in line:
+                    break  # quoted fields may span lines; let the csv module handle it
+                product_id = line.split(b",", 1)[0].strip()
+                if product_id:
+                    processed.add(product_id.decode("utf-8"))
+            else:
+                return processed
+
     processed = set()
     with open(path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        if "product_id" not in (reader.fieldnames or []):
+        reader = csv.reader(f)
+        header_row = next(reader, [])
+        if "product_id" not in header_row:
             # Different schema from a previous run; ignore resume to avoid confusion.
             return set()
+        col = header_row.index("product_id")
 
         for row in reader:
-            processed.add(row["product_id"])
+            if col < len(row):
+                processed.add(row[col])
     return processed
 
 
-def append_row(path: str, row: dict, write_header_if_needed: bool = True) -> None:
+_QUOTE_TRANS = str.maketrans({'"': '""'})
+
+
+def _q(value: str) -> str:
     """
-    Append a single row to the output CSV.
-    Writes the header if the file did not exist before.
+    Quote a CSV field the way csv.QUOTE_MINIMAL would: only when it contains
+    a delimiter, quote or line break.
     """
-    fieldnames = [
-        "product_id",         # this is product_source_id from the feed
-        "dash_id",            # internal Dash product.id
-        "dash_library_link",
-        "product_url",
-        "media_count",
-        "media_image_urls"
-    ]
+    if value and ('"' in value or "," in value or "\n" in value or "\r" in value):
+        return '"' + value.translate(_QUOTE_TRANS) + '"'
+    return value
 
-    file_exists = os.path.exists(path)
-    write_header = (not file_exists) and write_header_if_needed
 
-    with open(path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+def append_row(
+    out_f: TextIO,
+    product_source_id: str,
+    dash_id: Optional[int],
+    dash_library_link: str,
+    product_url: Optional[str],
+    media_count: int,
+    media_image_urls: str,
+) -> None:
+    """
+    Append a single row to the output CSV as one pre-formatted line.
+    The columns follow FIELDNAMES; flushing is left to the caller.
+    """
+    out_f.write(
+        f"{_q(product_source_id)},{dash_id if dash_id is not None else ''},"
+        f"{_q(dash_library_link)},{_q(product_url or '')},{media_count},"
+        f"{_q(media_image_urls)}\r\n"
+    )
 
-        if write_header:
-            writer.writeheader()
 
-        writer.writerow(row)
-        f.flush()  # ensure immediate write to disk
+def make_appender(path: str) -> Tuple[Callable[..., None], TextIO]:
+    """
+    Open the output CSV once for the whole run and return (append, file).
+    Whether the header is needed is checked here, once, rather than per row.
+    append() takes append_row's column arguments and flushes every
+    FLUSH_EVERY_ROWS rows; closing the file flushes the rest.
+    """
+    header_written = os.path.exists(path) and os.path.getsize(path) > 0
+    f = open(path, "a", newline="", encoding="utf-8", buffering=1 << 16)
+    if not header_written:
+        f.write(",".join(FIELDNAMES) + "\r\n")
+    written = 0
 
+    def append(*columns) -> None:
+        nonlocal written
+        append_row(f, *columns)
+        written += 1
+        if written % FLUSH_EVERY_ROWS == 0:
+            f.flush()
 
-def build_dash_library_link(brand_name: Optional[str], dash_id: Optional[int]) -> str:
+    return append, f
+
+
+def shard_path(shard: int, shards: int) -> str:
+    """
+    Output path for one shard: OUTPUT_CSV_PATH itself when not sharding,
+    otherwise e.g. product_media_report.part{shard}.csv.
+    """
+    if shards == 1:
+        return OUTPUT_CSV_PATH
+    root, ext = os.path.splitext(OUTPUT_CSV_PATH)
+    return f"{root}.part{shard}{ext}"
+
+
+def existing_output_paths() -> List[str]:
     """
-    Build the Dash Library link:
+    All output files a previous run may have written, sharded or not,
+    so resuming works even if --shards changed between runs.
+    """
+    root, ext = os.path.splitext(OUTPUT_CSV_PATH)
+    shard_paths = sorted(glob.glob(f"{glob.escape(root)}.part*{ext}"))
+    return [p for p in [OUTPUT_CSV_PATH] + shard_paths if os.path.exists(p)]
+
+
+def make_dash_library_link_builder(
+    brand_name: Optional[str],
+) -> Callable[[Optional[int]], str]:
+    """
+    Return build(dash_id), which builds the Dash Library link:
       https://app.dashhudson.com/{brand_name}/library/products?d=product%7CproductId%3A{dash_id}
-    Returns empty string if brand_name or dash_id is missing.
+    The brand-specific prefix is formatted once here, so each call is a
+    single concatenation. build() returns empty string if brand_name or
+    dash_id is missing.
     """
-    if not brand_name or not dash_id:
-        return ""
-    return (
+    prefix = (
         f"{LIBRARY_BASE_URL}/{brand_name}/library/products"
-        f"?d=product%7CproductId%3A{dash_id}"
+        f"?d=product%7CproductId%3A"
     )
 
+    def build(dash_id: Optional[int]) -> str:
+        if not brand_name or not dash_id:
+            return ""
+        return prefix + str(dash_id)
+
+    return build
+
+
+async def main_async(
+    brand_name: str,
+    pending: List[Tuple[int, str]],
+    appenders: List[Callable[..., None]],
+) -> None:
+    """
+    Fetch media for the pending (idx, product_source_id) pairs with up to
+    CONCURRENCY requests in flight. Ids are partitioned across one worker
+    per output shard; each worker writes its rows in input order as each
+    of its chunks completes.
+    """
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    limiter = AsyncLimiter(REQUESTS_PER_SECOND, 1)
+    build_dash_library_link = make_dash_library_link_builder(brand_name)
+
+    async def fetch(
+        client: httpx.AsyncClient, idx: int, product_source_id: str
+    ) -> Tuple[Optional[int], Optional[str], int, List[str]]:
+        async with semaphore:
+            print(f"[{idx}] Fetching media for {product_source_id}...")
+            media_items = await fetch_media_for_product_source_id(
+                client, limiter, product_source_id
+            )
+
+        if isinstance(media_items, list):
+            return extract_product_info(media_items, product_source_id)
+
+        # streamed from disk: parse in a thread so other requests keep flowing
+        try:
+            return await asyncio.to_thread(
+                extract_product_info, media_items, product_source_id
+            )
+        except ValueError as exc:
+            # same empty row as a parse error on the in-memory path
+            print(f"JSON parse error for {product_source_id}: {exc}", file=sys.stderr)
+            return extract_product_info([], product_source_id)
+
+    async def worker(
+        client: httpx.AsyncClient,
+        shard_pending: List[Tuple[int, str]],
+        append: Callable[..., None],
+    ) -> None:
+        for start in range(0, len(shard_pending), CONCURRENCY):
+            chunk = shard_pending[start:start + CONCURRENCY]
+            results = await asyncio.gather(
+                *(fetch(client, idx, psid) for idx, psid in chunk)
+            )
+
+            for (_, product_source_id), info in zip(chunk, results):
+                dash_id, product_url, media_count, media_image_urls = info
+
+                dash_library_link = build_dash_library_link(dash_id)
+
+                append(
+                    product_source_id,        # written as product_id
+                    dash_id,
+                    dash_library_link,
+                    product_url,
+                    media_count,              # 0 if no media
+                    "; ".join(media_image_urls),
+                )
+
+    # crc32 rather than hash() so an id lands in the same shard on every run
+    shards: List[List[Tuple[int, str]]] = [[] for _ in appenders]
+    for idx, product_source_id in pending:
+        shard = zlib.crc32(product_source_id.encode("utf-8")) % len(appenders)
+        shards[shard].append((idx, product_source_id))
+
+    # All requests go to one host. Once HTTP/2 is negotiated every in-flight
+    # request is multiplexed as a stream over that single connection; the
+    # CONCURRENCY cap only matters if the server falls back to HTTP/1.1.
+    limits = httpx.Limits(
+        max_connections=CONCURRENCY,
+        max_keepalive_connections=CONCURRENCY,
+    )
+    # Auth headers live on the client; connect failures are retried by the transport
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=limits, retries=3)
+    async with httpx.AsyncClient(headers=_AUTH_HEADERS, transport=transport) as client:
+        await asyncio.gather(
+            *(
+                worker(client, shard_pending, append)
+                for shard_pending, append in zip(shards, appenders)
+            )
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Report media counts and image URLs per product_source_id."
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Write output to N part files from N concurrent workers (default: 1).",
+    )
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    return args
+
 
 def main() -> None:
+    args = parse_args()
+
     if not BEARER_TOKEN or BEARER_TOKEN == "YOUR_BEARER_TOKEN_HERE":
         print("Please set BEARER_TOKEN at the top of the script.", file=sys.stderr)
         sys.exit(1)
 
+    prune_cache()
+
     # Fetch brand_name once from /api/self
     print(f"Fetching brand_name for brand_id={BRAND_ID} from /api/self...")
     brand_name = get_brand_name(BRAND_ID)
@@ -248,35 +716,28 @@ def main() -> None:
     product_source_ids = read_product_source_ids(INPUT_CSV_PATH)
     print(f"Found {len(product_source_ids)} product_source_id values.")
 
-    processed = load_already_processed_rows(OUTPUT_CSV_PATH)
+    processed = set()
+    for path in existing_output_paths():
+        processed |= load_already_processed_rows(path)
     if processed:
         print(f"Resuming: {len(processed)} product_id values already processed.")
 
+    pending: List[Tuple[int, str]] = []
     for idx, product_source_id in enumerate(product_source_ids, start=1):
         if product_source_id in processed:
             print(f"[{idx}] Skipping {product_source_id} (already processed)")
             continue
+        pending.append((idx, product_source_id))
 
-        print(f"[{idx}] Fetching media for {product_source_id}...")
-        media_items = fetch_media_for_product_source_id(product_source_id)
-
-        dash_id, product_url, media_count, media_image_urls = extract_product_info(
-            media_items, product_source_id
-        )
-
-        dash_library_link = build_dash_library_link(brand_name, dash_id)
-
-        row = {
-            "product_id": product_source_id,                 # renamed from product_source_id
-            "dash_id": dash_id if dash_id is not None else "",
-            "dash_library_link": dash_library_link,
-            "product_url": product_url or "",
-            "media_count": media_count,                      # 0 if no media
-            "media_image_urls": "; ".join(media_image_urls)
-        }
+    # Closing the files on the way out (including Ctrl-C) flushes any buffered rows
+    with contextlib.ExitStack() as stack:
+        appenders = []
+        for shard in range(args.shards):
+            append, out_f = make_appender(shard_path(shard, args.shards))
+            stack.enter_context(out_f)
+            appenders.append(append)
 
-        append_row(OUTPUT_CSV_PATH, row)
-        time.sleep(REQUEST_DELAY_SECONDS)
+        asyncio.run(main_async(brand_name, pending, appenders))
 
     print("Done. Rows were saved incrementally, safe to interrupt and resume.")
 